@@ -5,6 +5,13 @@ import os
 import json
 import random
 import itertools
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: lock the first byte of the lock file with msvcrt instead
+    fcntl = None
+    import msvcrt
 
 USAGE_FILE = os.path.join(os.path.dirname(__file__), "effect_usage.json")
 
@@ -33,8 +40,37 @@ def load_usage():
     return {"used": [], "video_map": {}}
 
 def save_usage(data):
-    with open(USAGE_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    # Write a temp file and swap it in, so a reader never sees a half-written file
+    tmp_path = f"{USAGE_FILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, USAGE_FILE)
+    except Exception as e:
+        print(f"Warning: Could not save usage file: {e}")
+
+
+@contextmanager
+def usage_file_lock():
+    """Exclusive lock shared by all render processes for the read-modify-write of USAGE_FILE."""
+    with open(USAGE_FILE + ".lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ~10 s; keep waiting
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
 
 USAGE_DATA = load_usage()
 
@@ -42,18 +78,23 @@ def pick_effect_for_video(video_id):
     if video_id in USAGE_DATA["video_map"]:
         return USAGE_DATA["video_map"][video_id]
 
-    used = [tuple(e) for e in USAGE_DATA["used"]]
+    # Parallel render processes share the file: reload, pick and save under one lock
+    with usage_file_lock():
+        USAGE_DATA.clear()
+        USAGE_DATA.update(load_usage())
+
+        used = [tuple(e) for e in USAGE_DATA["used"]]
 
-    if len(used) >= len(EFFECT_COMBOS):
-        USAGE_DATA["used"] = []
-        used = []
+        if len(used) >= len(EFFECT_COMBOS):
+            USAGE_DATA["used"] = []
+            used = []
 
-    available = [combo for combo in EFFECT_COMBOS if tuple(combo) not in used]
-    chosen = random.choice(available)
+        available = [combo for combo in EFFECT_COMBOS if tuple(combo) not in used]
+        chosen = random.choice(available)
 
-    USAGE_DATA["used"].append(chosen)
-    USAGE_DATA["video_map"][video_id] = chosen
-    save_usage(USAGE_DATA)
+        USAGE_DATA["used"].append(chosen)
+        USAGE_DATA["video_map"][video_id] = chosen
+        save_usage(USAGE_DATA)
     return chosen
 
 # -----------------------------
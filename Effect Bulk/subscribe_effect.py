@@ -1,8 +1,21 @@
 import cv2
 import os
-import imageio
+import imageio.v3 as iio
+import numpy as np
 import random
 import json
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: lock the first byte of the lock file with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; the NumPy blend below is the fallback
+    njit = None
 
 # ------------------------------------------------------------------
 # Correctly determine the GIF folder location (SubscribeEmoji folder)
@@ -35,12 +48,10 @@ def load_gifs(folder, video_width, ratio=0.25):
 
         path = os.path.join(folder, file)
         try:
-            gif_reader = imageio.get_reader(path)
-            frames_raw = [frame for frame in gif_reader]
-
             target_width = int(video_width * ratio)
             frames = []
-            for frame in frames_raw:
+            # Stream-decode so only the small resized frames stay in memory
+            for frame in iio.imiter(path, mode="RGBA"):
                 # Convert to BGRA (OpenCV format with alpha)
                 if frame.shape[2] == 4:  # Already has alpha
                     frame_rgba = frame
@@ -50,8 +61,12 @@ def load_gifs(folder, video_width, ratio=0.25):
                 frame_bgra = cv2.cvtColor(frame_rgba, cv2.COLOR_RGBA2BGRA)
                 scale = target_width / frame_bgra.shape[1]
                 target_height = int(frame_bgra.shape[0] * scale)
-                resized = cv2.resize(frame_bgra, (target_width, target_height), interpolation=cv2.INTER_LANCZOS4)
-                frames.append(resized)
+                resized = cv2.resize(frame_bgra, (target_width, target_height), interpolation=cv2.INTER_AREA)
+
+                # Precompute the blend inputs once so each video frame is a pure blend
+                alpha = resized[:, :, 3:4].astype(np.float32) * (1.0 / 255.0)
+                premul = resized[:, :, :3].astype(np.float32) * alpha
+                frames.append((premul, 1.0 - alpha))
 
             gifs[file] = frames
             print(f"   Loaded: {file} ({len(frames)} frames)")
@@ -77,13 +92,39 @@ def load_usage():
 
 
 def save_usage(data):
+    # Write a temp file and swap it in, so a reader never sees a half-written file
+    tmp_path = f"{USAGE_FILE}.{os.getpid()}.tmp"
     try:
-        with open(USAGE_FILE, "w") as f:
+        with open(tmp_path, "w") as f:
             json.dump(data, f, indent=2)
+        os.replace(tmp_path, USAGE_FILE)
     except Exception as e:
         print(f"Warning: Could not save usage file: {e}")
 
 
+@contextmanager
+def usage_file_lock():
+    """Exclusive lock shared by all render processes for the read-modify-write of USAGE_FILE."""
+    with open(USAGE_FILE + ".lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ~10 s; keep waiting
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 USAGE_DATA = load_usage()
 
 
@@ -100,21 +141,26 @@ def pick_gif_for_video(video_id="default"):
     if not all_names:
         return []  # No GIFs loaded
 
-    used = set(USAGE_DATA.get("used", []))
+    # Parallel render processes share the file: reload, pick and save under one lock
+    with usage_file_lock():
+        USAGE_DATA.clear()
+        USAGE_DATA.update(load_usage())
+
+        used = set(USAGE_DATA.get("used", []))
 
-    # Reset cycle if we've used all
-    if len(used) >= len(all_names):
-        USAGE_DATA["used"] = []
-        used = set()
+        # Reset cycle if we've used all
+        if len(used) >= len(all_names):
+            USAGE_DATA["used"] = []
+            used = set()
 
-    available = [n for n in all_names if n not in used]
-    if not available:
-        available = all_names
+        available = [n for n in all_names if n not in used]
+        if not available:
+            available = all_names
 
-    chosen_name = random.choice(available)
-    USAGE_DATA.setdefault("used", []).append(chosen_name)
-    USAGE_DATA.setdefault("video_map", {})[video_id] = chosen_name
-    save_usage(USAGE_DATA)
+        chosen_name = random.choice(available)
+        USAGE_DATA.setdefault("used", []).append(chosen_name)
+        USAGE_DATA.setdefault("video_map", {})[video_id] = chosen_name
+        save_usage(USAGE_DATA)
 
     return ALL_GIFS[chosen_name]
 
@@ -122,19 +168,36 @@ def pick_gif_for_video(video_id="default"):
 # ------------------------------------------------------------------
 # Alpha overlay helper
 # ------------------------------------------------------------------
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _blend_rows(roi, premul, inv_alpha):
+        h, w = premul.shape[:2]
+        for i in prange(h):
+            for j in range(w):
+                a = inv_alpha[i, j, 0]
+                for c in range(3):
+                    roi[i, j, c] = np.uint8(premul[i, j, c] + a * roi[i, j, c])
+else:
+    _blend_rows = None
+
+
 def overlay_transparent(background, overlay, x, y):
-    h, w = overlay.shape[:2]
+    """Blend a preprocessed (premultiplied_rgb, one_minus_alpha) overlay in place."""
+    premul, inv_alpha = overlay
+    h, w = premul.shape[:2]
 
     # Boundary check
     if y + h > background.shape[0] or x + w > background.shape[1] or y < 0 or x < 0:
         return
 
-    alpha = overlay[:, :, 3] / 255.0
-    for c in range(3):
-        background[y:y+h, x:x+w, c] = (
-            alpha * overlay[:, :, c] +
-            (1 - alpha) * background[y:y+h, x:x+w, c]
-        )
+    roi = background[y:y+h, x:x+w, :3]
+    if _blend_rows is not None:
+        _blend_rows(roi, premul, inv_alpha)
+        return
+
+    blended = roi * inv_alpha
+    blended += premul
+    np.copyto(roi, blended, casting="unsafe")
 
 
 # ------------------------------------------------------------------
@@ -165,11 +228,12 @@ def apply_effect_frame(frame, frame_idx, fps=30, video_id="default"):
     # Calculate which GIF frame to show
     gif_idx = int((elapsed_in_effect / duration_sec) * total_gif_frames) % total_gif_frames
     overlay = gif_frames[gif_idx]
+    overlay_h, overlay_w = overlay[0].shape[:2]
 
     # Position: bottom-right with 12px padding
     pad = 12
-    x = frame.shape[1] - overlay.shape[1] - pad
-    y = frame.shape[0] - overlay.shape[0] - pad
+    x = frame.shape[1] - overlay_w - pad
+    y = frame.shape[0] - overlay_h - pad
 
     overlay_transparent(frame, overlay, x, y)
     return frame
@@ -1,21 +1,46 @@
 import os                                                              
 import cv2                                                             
+import numpy as np
 import glob
 import subprocess
 import importlib.util                                                  
 import inspect
+import functools
 import random
 import uuid
 import whisper
+import torch
 import srt
+from mutagen import File as MutagenFile
+from PIL import Image, ImageDraw, ImageFont
 import re
+import tempfile
 import time 
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from datetime import timedelta
 import sys # NEW: Import sys for flushing/single-line printing
 
 # --- Configuration ---
 MAX_EDIT_RETRIES = 3 # NEW: Max retries for the entire video creation process
 LOG_CLEANUP_INTERVAL = 20 # NEW: Number of videos to process before clearing the console
+FRAME_QUEUE_SIZE = 4 # Max rendered frames waiting for the FFmpeg writer thread
+# Long GOP, single reference, no B-frames: the background barely changes, so keep motion search cheap
+X264_PARAMS = "keyint=600:min-keyint=600:scenecut=0:ref=1:bframes=0"
+MAX_PARALLEL_VIDEOS = max(1, min(4, (os.cpu_count() or 2) // 2)) # Pairs rendered concurrently (one FFmpeg + Whisper each)
+LISTING_REFRESH_INTERVAL = 60 # Seconds before a cached directory listing is re-read even if its mtime is unchanged
+
+# Subtitle style (mirrors the libass force_style below; sizes are in ASS units,
+# which libass scales from a 288-line script to the video height for SRT input)
+SUBTITLE_FONTS = ("arial.ttf", "Arial.ttf", "DejaVuSans.ttf")
+SUBTITLE_FONT_SIZE = 28
+SUBTITLE_OUTLINE = 1
+SUBTITLE_SHADOW = 1
+ASS_PLAY_RES = (384, 288)
 
 # Directories
 base_dir = os.path.dirname(os.path.abspath(__file__))                  
@@ -37,6 +62,16 @@ else:
 # -----------------------                                              
 # Load effect modules dynamically
 # -----------------------                                              
+@dataclass(frozen=True)
+class EffectSpec:
+    """An effect's apply_effect_frame plus which optional kwargs it accepts."""
+    name: str
+    fn: object
+    needs_frame_idx: bool
+    needs_fps: bool
+    needs_video_id: bool
+    needs_audio_name: bool
+
 def load_effect_modules():
     modules = []
     for effect_file in glob.glob(os.path.join(effects_dir, "*.py")):
@@ -46,7 +81,16 @@ def load_effect_modules():
             module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(module)
             if hasattr(module, "apply_effect_frame"):
-                modules.append(module.apply_effect_frame)
+                # Inspect the signature once here, never in the render loop
+                params = inspect.signature(module.apply_effect_frame).parameters
+                modules.append(EffectSpec(
+                    name=name,
+                    fn=module.apply_effect_frame,
+                    needs_frame_idx="frame_idx" in params,
+                    needs_fps="fps" in params,
+                    needs_video_id="video_id" in params,
+                    needs_audio_name="audio_name" in params,
+                ))
             else:
                 print(f"⚠️ Skipping {effect_file} (no apply_effect_frame function)")
         except Exception as e:
@@ -55,6 +99,54 @@ def load_effect_modules():
 
 effects_list = load_effect_modules()
 
+# -----------------------
+# Whisper model cache (loaded on first use, on GPU when available)
+# -----------------------
+WHISPER_MODEL_SIZE = "tiny"
+WHISPER_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+_whisper_models = {}
+
+def _get_whisper_model(model_size=WHISPER_MODEL_SIZE):
+    """Loads each Whisper model size once and reuses it across retries and videos."""
+    if model_size not in _whisper_models:
+        print(f"🧠 Loading Whisper '{model_size}' model on {WHISPER_DEVICE}...")
+        _whisper_models[model_size] = whisper.load_model(model_size, device=WHISPER_DEVICE)
+    return _whisper_models[model_size]
+
+# -----------------------
+# Resolve effect kwargs once per video
+# -----------------------
+def build_effect_pipeline(effects, fps, video_id, audio_name):
+    """Returns (name, fn, wants_frame_idx) tuples with static kwargs already bound."""
+    pipeline = []
+    for effect in effects:
+        kwargs = {}
+        if effect.needs_fps: kwargs["fps"] = fps
+        if effect.needs_video_id: kwargs["video_id"] = video_id
+        if effect.needs_audio_name: kwargs["audio_name"] = audio_name
+        fn = functools.partial(effect.fn, **kwargs) if kwargs else effect.fn
+        pipeline.append((effect.name, fn, effect.needs_frame_idx))
+    return pipeline
+
+# -----------------------
+# Cached directory listings for the polling loop
+# -----------------------
+_listing_cache = {}
+
+def list_media(directory, extensions):
+    """Sorted media files in directory; only re-lists when the directory's mtime changes."""
+    mtime = os.stat(directory).st_mtime_ns
+    cached = _listing_cache.get(directory)
+    if cached and cached[0] == mtime and time.monotonic() - cached[1] < LISTING_REFRESH_INTERVAL:
+        return cached[2]
+
+    files = sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.lower().endswith(extensions)
+    )
+    _listing_cache[directory] = (mtime, time.monotonic(), files)
+    return files
+
 # -----------------------
 # Unique random video name
 # -----------------------
@@ -65,15 +157,16 @@ def get_random_video_name(output_dir, prefix="video_", ext=".mp4"):
 # -----------------------
 # Subtitle Generation (with safe filename)
 # -----------------------
-def generate_srt(audio_path, model_size="tiny"):
+def generate_srt(audio_path, model_size=WHISPER_MODEL_SIZE):
     """Generates an SRT subtitle file from an audio file using OpenAI's Whisper."""
     print("🚀 Generating subtitles with Whisper...")
 
     raw_srt_path = os.path.splitext(audio_path)[0] + ".srt"
 
     try:
-        model = whisper.load_model(model_size)
-        result = model.transcribe(audio_path, verbose=False)
+        model = _get_whisper_model(model_size)
+        # fp16 is only supported on CUDA; Whisper falls back to fp32 on CPU anyway
+        result = model.transcribe(audio_path, fp16=(WHISPER_DEVICE == "cuda"), verbose=False)
         subtitles = []
 
         for i, seg in enumerate(result["segments"]):
@@ -105,42 +198,191 @@ def generate_srt(audio_path, model_size="tiny"):
         return None
 
 # -----------------------
-# Main video creation function
+# Decoded base image cache (retries reuse the same decode)
 # -----------------------
-def create_video(image_path, audio_path, srt_path, output_path, fps=10):
-    print(f"\n🎬 Starting video creation for: {os.path.basename(audio_path)}")
-
-    # 1. Image and Dimensions
+@functools.lru_cache(maxsize=8)
+def _load_image(image_path, mtime):
+    """Reads and resizes an image to even dimensions; cached per (path, mtime)."""
     img = cv2.imread(image_path)
     if img is None:
-        print(f"❌ Error: Image not found or could not be loaded: {image_path}")
-        return False 
+        return None
 
     h, w, _ = img.shape
     if w % 2 != 0: w -= 1
     if h % 2 != 0: h -= 1
     img = cv2.resize(img, (w, h))
+    img.flags.writeable = False  # Shared by every caller, so keep it immutable
+    return img
 
-    # 2. Get Audio Duration
+# -----------------------
+# Audio duration (header parse, ffprobe fallback)
+# -----------------------
+def get_audio_duration(audio_path):
+    """Reads the duration from the audio header with mutagen, falling back to ffprobe."""
+    try:
+        audio = MutagenFile(audio_path)
+        if audio is not None and audio.info.length > 0:
+            return audio.info.length
+    except Exception as e:
+        print(f"⚠️ mutagen could not read {os.path.basename(audio_path)}: {e}. Falling back to ffprobe.")
+
+    result = None
     try:
         cmd_duration = [
             'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
             '-of', 'default=noprint_wrappers=1:nokey=1', audio_path
         ]
         result = subprocess.run(cmd_duration, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-        duration = float(result.stdout.strip())
-        total_frames = int(duration * fps)
-        print(f"✅ Audio duration: {duration:.2f}s, Total frames to process: {total_frames}")
-        if total_frames <= 0:
-            print("⚠️ Warning: Audio duration is too short. Skipping video creation.")
-            return False 
+        return float(result.stdout.strip())
     except Exception as e:
-        print(f"❌ Error getting audio duration with ffprobe: {e}. Stderr: {result.stderr if 'result' in locals() else 'N/A'}")
+        print(f"❌ Error getting audio duration with ffprobe: {e}. Stderr: {result.stderr if result else 'N/A'}")
+        return None
+
+# -----------------------
+# Background FFmpeg stdin writer
+# -----------------------
+def _pipe_writer(frame_queue, stdin, errors):
+    """Drains frame_queue into FFmpeg's stdin until a None sentinel arrives."""
+    while True:
+        buf = frame_queue.get()
+        if buf is None:
+            return
+        if errors:
+            continue  # Keep draining so the render loop never blocks on a dead pipe
+        try:
+            stdin.write(buf)
+        except Exception as e:
+            errors.append(e)
+
+# -----------------------
+# Pre-rendered subtitle overlays
+# -----------------------
+def _load_subtitle_font(size):
+    for name in SUBTITLE_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return None
+
+def _wrap_subtitle(draw, text, font, max_width):
+    lines = []
+    for paragraph in text.splitlines():
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}".strip()
+            if line and draw.textlength(candidate, font=font) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        if line:
+            lines.append(line)
+    return lines
+
+def render_subtitle_overlays(srt_path, frame_w, frame_h, out_dir):
+    """Rasterizes each SRT caption to an RGBA PNG once.
+
+    Returns a list of (png_path, start_sec, end_sec), or None if no usable
+    font is installed (the caller then falls back to the libass filter).
+    """
+    scale = frame_h / ASS_PLAY_RES[1]
+    font = _load_subtitle_font(max(1, round(SUBTITLE_FONT_SIZE * scale)))
+    if font is None:
+        return None
+
+    outline = max(1, round(SUBTITLE_OUTLINE * scale))
+    shadow = max(1, round(SUBTITLE_SHADOW * scale))
+    margin = round(10 * frame_w / ASS_PLAY_RES[0])  # libass default MarginL/MarginR
+    ascent, descent = font.getmetrics()
+    line_h = ascent + descent + 2 * outline
+
+    with open(srt_path, "r", encoding="utf-8") as f:
+        subtitles = list(srt.parse(f.read()))
+
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    overlays = []
+    for i, sub in enumerate(subtitles):
+        lines = _wrap_subtitle(measure, sub.content, font, frame_w - 2 * margin)
+        if not lines:
+            continue
+
+        widths = [measure.textlength(line, font=font) for line in lines]
+        canvas_w = int(max(widths)) + 2 * outline + shadow
+        canvas_h = line_h * len(lines) + shadow
+        canvas = Image.new("RGBA", (canvas_w, canvas_h), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(canvas)
+        for n, (line, line_w) in enumerate(zip(lines, widths)):
+            x = (canvas_w - shadow - line_w) / 2
+            y = n * line_h + outline
+            draw.text((x + shadow, y + shadow), line, font=font, fill=(0, 0, 0, 255),
+                      stroke_width=outline, stroke_fill=(0, 0, 0, 255))
+            draw.text((x, y), line, font=font, fill=(255, 255, 255, 255),
+                      stroke_width=outline, stroke_fill=(0, 0, 0, 255))
+
+        png_path = os.path.join(out_dir, f"sub_{i:04d}.png")
+        canvas.save(png_path)
+        overlays.append((png_path, sub.start.total_seconds(), sub.end.total_seconds()))
+
+    return overlays
+
+def build_overlay_filter_complex(base_filter, overlays, first_input):
+    """Chains one centered, time-gated overlay per caption onto the video stream."""
+    chain = [f"[0:v]{base_filter or 'null'}[v0]"]
+    for n, (_, start, end) in enumerate(overlays, 1):
+        chain.append(
+            f"[v{n-1}][{first_input + n - 1}:v]overlay=x=(W-w)/2:y=(H-h)/2"
+            # End is exclusive like libass, so back-to-back captions never share a frame
+            f":enable='gte(t,{start:.3f})*lt(t,{end:.3f})'[v{n}]"
+        )
+    return ";".join(chain), f"[v{len(overlays)}]"
+
+# -----------------------
+# Main video creation function
+# -----------------------
+def create_video(image_path, audio_path, srt_path, output_path, fps=10):
+    print(f"\n🎬 Starting video creation for: {os.path.basename(audio_path)}")
+
+    # Pre-rendered subtitle PNGs only need to live until FFmpeg exits
+    with tempfile.TemporaryDirectory(prefix="subs_") as subtitle_dir:
+        return _render_video(image_path, audio_path, srt_path, output_path, fps, subtitle_dir)
+
+def _render_video(image_path, audio_path, srt_path, output_path, fps, subtitle_dir):
+    # 1. Image and Dimensions
+    try:
+        img = _load_image(image_path, os.path.getmtime(image_path))
+    except OSError:
+        img = None
+    if img is None:
+        print(f"❌ Error: Image not found or could not be loaded: {image_path}")
+        return False 
+
+    h, w, _ = img.shape
+
+    # 2. Get Audio Duration
+    duration = get_audio_duration(audio_path)
+    if duration is None:
+        return False
+
+    total_frames = int(duration * fps)
+    print(f"✅ Audio duration: {duration:.2f}s, Total frames to process: {total_frames}")
+    if total_frames <= 0:
+        print("⚠️ Warning: Audio duration is too short. Skipping video creation.")
         return False 
 
     # 3. Subtitles
+    # Captions are rasterized once and overlaid with a timed enable= expression,
+    # so libass no longer parses/shapes/rasterizes on every frame.
     video_filters = ""
+    subtitle_overlays = None
     if srt_path and os.path.exists(srt_path):
+        try:
+            subtitle_overlays = render_subtitle_overlays(srt_path, w, h, subtitle_dir)
+        except Exception as e:
+            print(f"⚠️ Could not pre-render subtitles: {e}. Falling back to the subtitles filter.")
+    if subtitle_overlays is not None:
+        print(f"✅ Pre-rendered {len(subtitle_overlays)} subtitle overlays.")
+    elif srt_path and os.path.exists(srt_path):
         # FFmpeg filter style
         srt_path_ffmpeg = os.path.abspath(srt_path).replace("\\", "/")
         # Escaping colons for Windows paths in FFmpeg
@@ -165,49 +407,110 @@ def create_video(image_path, audio_path, srt_path, output_path, fps=10):
 
 
     # 4. FFmpeg command
-    ffmpeg_cmd = [
-        'ffmpeg', '-y',
-        '-f', 'rawvideo',
-        '-vcodec', 'rawvideo',
-        '-pix_fmt', 'bgr24',
-        '-s', f'{w}x{h}',
-        '-r', str(fps),
-        '-i', 'pipe:0',
-        '-i', audio_path,
-    ]
-    if video_filters:
+    # Without per-frame effects every frame is the same still image, so let
+    # FFmpeg loop it instead of piping thousands of identical raw frames.
+    use_loop_mode = not effects_list
+    if use_loop_mode:
+        ffmpeg_cmd = [
+            'ffmpeg', '-y',
+            '-loop', '1',
+            '-framerate', str(fps),
+            '-i', image_path,
+            '-i', audio_path,
+        ]
+        # Match the even dimensions the raw pipe path resizes to
+        video_filters = ",".join(f for f in (f"scale={w}:{h}", video_filters) if f)
+    else:
+        ffmpeg_cmd = [
+            'ffmpeg', '-y',
+            '-f', 'rawvideo',
+            '-vcodec', 'rawvideo',
+            '-pix_fmt', 'yuv420p',
+            '-s', f'{w}x{h}',
+            '-r', str(fps),
+            '-i', 'pipe:0',
+            '-i', audio_path,
+        ]
+    if subtitle_overlays:
+        for png_path, _, _ in subtitle_overlays:
+            ffmpeg_cmd.extend(['-i', png_path])
+        filter_complex, video_out = build_overlay_filter_complex(video_filters, subtitle_overlays, first_input=2)
+        ffmpeg_cmd.extend(['-filter_complex', filter_complex, '-map', video_out, '-map', '1:a'])
+    elif video_filters:
         ffmpeg_cmd.extend(['-vf', video_filters])
     ffmpeg_cmd.extend([
         '-c:v', 'libx264',
         '-preset', 'ultrafast',
+        '-tune', 'stillimage',
+        '-x264-params', X264_PARAMS,
+    ])
+    if use_loop_mode:
+        ffmpeg_cmd.extend(['-t', f'{duration:.3f}'])
+    ffmpeg_cmd.extend([
         '-pix_fmt', 'yuv420p',
         '-c:a', 'aac',
         '-shortest',
         output_path
     ])
 
+    # 5a. Loop mode: FFmpeg renders every frame itself
+    if use_loop_mode:
+        print("✅ No effects loaded. Letting FFmpeg loop the still image.")
+        try:
+            result = subprocess.run(ffmpeg_cmd, stdin=subprocess.DEVNULL, timeout=duration + 30)
+        except subprocess.TimeoutExpired:
+            print(f"\n❌ FFmpeg timed out while encoding the looped image.")
+            return False
+
+        if result.returncode != 0:
+            print(f"\n❌ FFmpeg failed with return code {result.returncode}.")
+            return False
+
+        print(f"\n🎉 Video created without effects: {output_path}")
+        return True
+
+    # Resolve effect signatures once instead of on every frame
+    pipeline = build_effect_pipeline(
+        effects_list,
+        fps=fps,
+        video_id=os.path.basename(output_path),
+        audio_name=os.path.splitext(os.path.basename(audio_path))[0],
+    )
+
     process = None
+    writer = None
+    frame_queue = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+    write_errors = []
     try:
         process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
 
+        # Pipe writes run on their own thread so the next frame renders meanwhile
+        writer = threading.Thread(target=_pipe_writer, args=(frame_queue, process.stdin, write_errors), daemon=True)
+        writer.start()
+
         # 5. Write frames
+        # Effects return new arrays or mutate in place, so one scratch copy of
+        # the base image per frame is enough (img itself is never touched).
+        # Frames are converted to I420 here (half the bytes of bgr24, and no
+        # swscale pass in FFmpeg) and queued as zero-copy views, so rotate
+        # through enough YUV buffers that none is overwritten while queued.
+        scratch = np.empty_like(img)
+        yuv_ring = [np.empty((h * 3 // 2, w), dtype=np.uint8) for _ in range(FRAME_QUEUE_SIZE + 2)]
         for frame_idx in range(total_frames):
-            frame = img.copy()
+            np.copyto(scratch, img)
+            frame = scratch
 
             # Apply effects
-            for effect in effects_list:
+            for name, fn, wants_frame_idx in pipeline:
                 try:
-                    sig = inspect.signature(effect)
-                    kwargs = {}
-                    if "frame_idx" in sig.parameters: kwargs["frame_idx"] = frame_idx
-                    if "fps" in sig.parameters: kwargs["fps"] = fps
-                    if "video_id" in sig.parameters: kwargs["video_id"] = os.path.basename(output_path)
-                    if "audio_name" in sig.parameters: kwargs["audio_name"] = os.path.splitext(os.path.basename(audio_path))[0]
-                    frame = effect(frame, **kwargs)
+                    frame = fn(frame, frame_idx=frame_idx) if wants_frame_idx else fn(frame)
                 except Exception as e:
-                    print(f"❌ Error applying effect {effect.__name__}: {e}")
+                    print(f"❌ Error applying effect {name}: {e}")
 
-            process.stdin.write(frame.tobytes())
+            if write_errors:
+                raise write_errors[0]
+            yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=yuv_ring[frame_idx % len(yuv_ring)])
+            frame_queue.put(memoryview(yuv).cast("B"))
             
             # Print progress on a single line
             if (frame_idx + 1) % fps == 0 or frame_idx == total_frames - 1:
@@ -215,6 +518,10 @@ def create_video(image_path, audio_path, srt_path, output_path, fps=10):
                 sys.stdout.flush() # Ensure the output updates immediately
 
         # 6. Cleanup
+        frame_queue.put(None)
+        writer.join()
+        if write_errors:
+            raise write_errors[0]
         process.stdin.close()
         process.wait(timeout=30) 
 
@@ -234,6 +541,75 @@ def create_video(image_path, audio_path, srt_path, output_path, fps=10):
         print(f"\n❌ Error during video processing: {e}")
         if process: process.kill()
         return False
+    finally:
+        if writer and writer.is_alive():
+            frame_queue.put(None)
+            writer.join()
+
+# -----------------------
+# Process one image/audio pair (runs inside a worker process)
+# -----------------------
+def process_pair(img_path, aud_path):
+    """Subtitles + video (with retries) for one pair, then cleans up. Returns True on success."""
+
+    # --- NEW: Retry Logic Loop ---
+    attempt = 0
+    video_success = False
+    srt_file = None
+    
+    while attempt < MAX_EDIT_RETRIES:
+        attempt += 1
+        print(f"\n--- Processing Pair: {os.path.basename(img_path)} and {os.path.basename(aud_path)} (Attempt {attempt}/{MAX_EDIT_RETRIES}) ---")
+        
+        try:
+            # 1. Generate Subtitles (Only do this once per audio)
+            if attempt == 1:
+                srt_file = generate_srt(aud_path)
+                if not srt_file:
+                    # If SRT fails on the first attempt, no need to retry video creation
+                    print("❌ Subtitle generation failed. Cannot proceed with video.")
+                    break # Break out of the retry loop
+
+            # 2. Create Video
+            out_file = get_random_video_name(output_dir, prefix="video_", ext=".mp4")
+            video_success = create_video(img_path, aud_path, srt_file, out_file)
+            
+            if video_success:
+                break # Success! Break out of the retry loop
+
+        except Exception as e:
+            print(f"❌ An unhandled error occurred during attempt {attempt} for {os.path.basename(aud_path)}. Error: {e}")
+            video_success = False
+            
+        # If failed, sleep before the next retry
+        if not video_success and attempt < MAX_EDIT_RETRIES:
+            print(f"⚠️ Video creation failed. Retrying in 5 seconds...")
+            time.sleep(5)
+            
+    # --- End Retry Logic Loop ---
+
+
+    # --- Final Cleanup ---
+    
+    # 3. Cleanup SRT
+    if srt_file and os.path.exists(srt_file):
+        os.remove(srt_file)
+        print(f"🧹 Cleaned up temporary subtitle file: {srt_file}")
+
+    # 4. Delete Source Files ONLY on final success or after max retries
+    if video_success:
+        try:
+            os.remove(aud_path)
+            print(f"🗑️ Deleted source audio: {os.path.basename(aud_path)}")
+            os.remove(img_path)
+            print(f"🗑️ Deleted source image: {os.path.basename(img_path)}")
+        except Exception as e:
+            print(f"❌ Failed to delete source files {os.path.basename(aud_path)} and {os.path.basename(img_path)}: {e}")
+    else:
+        # Failed after MAX_EDIT_RETRIES attempts
+        print(f"⚠️ Video creation failed after {MAX_EDIT_RETRIES} attempts. **Skipping and keeping** source files: {os.path.basename(aud_path)} and {os.path.basename(img_path)} for inspection.")
+
+    return video_success
 
 # -----------------------
 # Continuous batch process
@@ -242,11 +618,15 @@ if __name__ == "__main__":
     
     # NEW: Counter for log cleanup
     processed_count = 0
+
+    # Each pair is an independent FFmpeg encode, so render several at once.
+    # "spawn" gives every worker its own Whisper model and CUDA context.
+    executor = ProcessPoolExecutor(max_workers=MAX_PARALLEL_VIDEOS, mp_context=multiprocessing.get_context("spawn"))
     
     while True:
         # Get list of files to process
-        images = sorted([os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith(('.png','.jpg','.jpeg'))])
-        audios = sorted([os.path.join(audio_dir, f) for f in os.listdir(audio_dir) if f.lower().endswith(('.mp3','.flac','.wav','.aac'))])
+        images = list_media(image_dir, ('.png','.jpg','.jpeg'))
+        audios = list_media(audio_dir, ('.mp3','.flac','.wav','.aac'))
 
         total_videos = min(len(images), len(audios))
 
@@ -258,69 +638,20 @@ if __name__ == "__main__":
             continue 
         
         # Once files are found, print a new line over the waiting message
-        print(f"\nFound {total_videos} pairs to process.") 
-        
-        # Process the first available pair
-        img_path = images[0]
-        aud_path = audios[0]
-        
-        # --- NEW: Retry Logic Loop ---
-        attempt = 0
-        video_success = False
-        srt_file = None
+        print(f"\nFound {total_videos} pairs to process ({MAX_PARALLEL_VIDEOS} in parallel).") 
         
-        while attempt < MAX_EDIT_RETRIES:
-            attempt += 1
-            print(f"\n--- Processing Pair: {os.path.basename(img_path)} and {os.path.basename(aud_path)} (Attempt {attempt}/{MAX_EDIT_RETRIES}) ---")
-            
-            try:
-                # 1. Generate Subtitles (Only do this once per audio)
-                if attempt == 1:
-                    srt_file = generate_srt(aud_path)
-                    if not srt_file:
-                        # If SRT fails on the first attempt, no need to retry video creation
-                        print("❌ Subtitle generation failed. Cannot proceed with video.")
-                        break # Break out of the retry loop
-
-                # 2. Create Video
-                out_file = get_random_video_name(output_dir, prefix="video_", ext=".mp4")
-                video_success = create_video(img_path, aud_path, srt_file, out_file)
-                
-                if video_success:
-                    break # Success! Break out of the retry loop
-
-            except Exception as e:
-                print(f"❌ An unhandled error occurred during attempt {attempt} for {os.path.basename(aud_path)}. Error: {e}")
-                video_success = False
-                
-            # If failed, sleep before the next retry
-            if not video_success and attempt < MAX_EDIT_RETRIES:
-                print(f"⚠️ Video creation failed. Retrying in 5 seconds...")
-                time.sleep(5)
-                
-        # --- End Retry Logic Loop ---
-
-
-        # --- Final Cleanup ---
-        
-        # 3. Cleanup SRT
-        if srt_file and os.path.exists(srt_file):
-            os.remove(srt_file)
-            print(f"🧹 Cleaned up temporary subtitle file: {srt_file}")
-
-        # 4. Delete Source Files ONLY on final success or after max retries
-        if video_success:
-            processed_count += 1
+        # Process every available pair, pairing them in sorted order
+        futures = [executor.submit(process_pair, img_path, aud_path) for img_path, aud_path in zip(images, audios)]
+        for future in futures:
             try:
-                os.remove(aud_path)
-                print(f"🗑️ Deleted source audio: {os.path.basename(aud_path)}")
-                os.remove(img_path)
-                print(f"🗑️ Deleted source image: {os.path.basename(img_path)}")
+                if future.result():
+                    processed_count += 1
+            except BrokenProcessPool as e:
+                print(f"❌ A video worker process died: {e}. Restarting the worker pool.")
+                executor = ProcessPoolExecutor(max_workers=MAX_PARALLEL_VIDEOS, mp_context=multiprocessing.get_context("spawn"))
+                break
             except Exception as e:
-                print(f"❌ Failed to delete source files {os.path.basename(aud_path)} and {os.path.basename(img_path)}: {e}")
-        else:
-            # Failed after MAX_EDIT_RETRIES attempts
-            print(f"⚠️ Video creation failed after {MAX_EDIT_RETRIES} attempts. **Skipping and keeping** source files: {os.path.basename(aud_path)} and {os.path.basename(img_path)} for inspection.")
+                print(f"❌ A video worker raised an unexpected error: {e}")
 
         
         # 5. Log Cleanup (NEW FEATURE)
@@ -333,5 +664,5 @@ if __name__ == "__main__":
             processed_count = 0 
 
 
-        # Continue to the next iteration immediately to check for the next pair
+        # Continue to the next iteration immediately to check for the next batch
         # The 10-second delay is now only triggered when no files are found.
@@ -1,12 +1,25 @@
 import os
+import argparse
 import requests
 import pymongo
 import random
 import time
 import json
-import sys # For flushing stdout and progress bar
-from urllib.parse import quote
+import logging
+import threading
+import uuid
+import orjson
+import sys # Progress bar output stream
+import shutil
+from urllib.parse import quote, urlsplit
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pymongo import DeleteOne
 from pymongo.errors import ConnectionFailure, OperationFailure
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
 from tqdm import tqdm # Import for progress bar
 
 # --- Configuration ---
@@ -15,25 +28,51 @@ MONGO_URI =  os.environ.get("MONGO_URI")
 DATABASE_NAME = "songsdb"
 COLLECTION_NAME = "generatedSongs"
 OUTPUT_FOLDER = "audio"               # Final folder for song files
-TEMP_FOLDER = "temp_downloads"         # Temp folder to prevent partial files
 IMAGE_FOLDER = "images"               # Final folder for image files
+IMAGE_BANK_FOLDER = "image_pool"      # Pregenerated backgrounds reused instead of calling Pollinations
+STAGING_SUFFIX = ".staged"            # Files still being prepared; the editor's extension filter skips them
 MAX_SONG_DOWNLOAD_RETRIES = 3         # Max retries for song download
+MAX_IMAGE_GENERATION_RETRIES = 5      # Max Pollinations attempts per image (each on the next model)
 MAX_MONGO_CONNECT_RETRIES = 10        # Max retries for initial MongoDB connection
 LOG_CLEANUP_INTERVAL = 20             # Number of documents to process before clearing the console
+WORKER_CONCURRENCY = 8                # Documents processed in parallel (download + image generation)
+WORKER_ID = uuid.uuid4().hex          # Marks the documents this worker process has claimed
+CLAIM_TIMEOUT_SECONDS = 3600          # Claims older than this are treated as abandoned by a crashed worker
+STALE_CLAIM_CHECK_INTERVAL = 300      # Seconds between sweeps that release abandoned claims
+RANGED_DOWNLOAD_PARTS = 4             # Parallel byte ranges per song download
+RANGED_DOWNLOAD_MIN_BYTES = 4 * 1024 * 1024  # Smaller files are streamed in one request
+# In-flight requests allowed per host, so one service's rate limit doesn't throttle the others
+HOST_CONCURRENCY = {
+    "openrouter.ai": 4,
+    "image.pollinations.ai": 8,
+}
+DEFAULT_HOST_CONCURRENCY = 16         # Any other host, i.e. the audio CDN
 
 # --- OpenRouter/Pollinations Configuration for Image Generation ---
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_MODEL = "openai/gpt-3.5-turbo" 
 
+PROMPT_BATCH_SIZE = 10                # Prompts requested per OpenRouter call
+
 PROMPT_SYSTEM_MESSAGE = (
     "You are a creative prompt generator for high-resolution, cinematic AI images. "
-    "Your output must be a single, highly detailed, visually descriptive prompt for an image "
+    "Each prompt must be a single, highly detailed, visually descriptive prompt for an image "
     "that embodies the **Lofi, Chillhop, or Ambient music aesthetic**. Focus on elements like "
     "cozy rooms, rainy windows, neon lights, soft atmosphere, and cinematic depth. "
-    "The prompt must be just the image description text, with absolutely no surrounding text, comments, or headings."
+    "Each prompt must be just the image description text, with absolutely no surrounding text, comments, or headings. "
+    "Your output must be a JSON array of prompt strings and nothing else."
 )
 
+# Prompt pool: once enough prompts are cached on disk, most songs reuse one instead of calling OpenRouter
+PROMPT_CACHE_FILE = "prompt_cache.jsonl"
+PROMPT_CACHE_MIN_SIZE = 200           # Cached prompts needed before reuse kicks in
+PROMPT_CACHE_MAX_SIZE = 1000          # Most recent prompts kept (in memory and, after compaction, on disk)
+PROMPT_CACHE_REUSE_PROBABILITY = 0.9  # Chance of reusing a cached prompt instead of generating one
+
+# Set by --regenerate: always generate a fresh image through Pollinations, even with a filled image bank
+REGENERATE_IMAGES = False
+
 # Image Generation Settings
 WIDTH = 1920
 HEIGHT = 1080
@@ -43,11 +82,99 @@ MODELS = [
     "sdxl",
     "revAnimated",
 ]
+# Pollinations URL per model (same order as MODELS); only the encoded prompt varies per image
+URL_TEMPLATES = [
+    f"https://image.pollinations.ai/prompt/{{p}}?model={m}&width={WIDTH}&height={HEIGHT}"
+    for m in MODELS
+]
+
+# Shared HTTP session so OpenRouter, Pollinations and audio CDN connections are kept
+# alive between calls. Pool is sized for the worker threads and parallel download ranges;
+# retries stay in the explicit loops below.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+def host_slot(url):
+    """Semaphore limiting concurrent requests to url's host (see HOST_CONCURRENCY)."""
+    host = urlsplit(url).hostname or ""
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+        return _host_slots[host]
+
+logger = logging.getLogger("worker")
 
 # --- Helper Functions for Image Generation ---
 
-def get_openrouter_prompt():
-    """Fetches a detailed Lofi/Cinematic image generation prompt from OpenRouter, with unlimited retries."""
+def compact_prompt_cache(entries):
+    """Rewrites PROMPT_CACHE_FILE to hold just `entries` (atomically, via a temp file)."""
+    tmp_path = PROMPT_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for prompt, _ in entries:
+                f.write(json.dumps({"prompt": prompt}) + "\n")
+        os.replace(tmp_path, PROMPT_CACHE_FILE)
+    except Exception as e:
+        logger.warning(f"⚠️ [PROMPT] Could not compact prompt cache: {e}")
+
+
+def load_prompt_cache():
+    """Loads the most recent cached prompts from PROMPT_CACHE_FILE as (prompt, url-encoded prompt) pairs."""
+    prompts = []
+    if os.path.exists(PROMPT_CACHE_FILE):
+        try:
+            with open(PROMPT_CACHE_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        prompt = json.loads(line)["prompt"]
+                        prompts.append((prompt, quote(prompt)))
+        except Exception as e:
+            logger.warning(f"⚠️ [PROMPT] Could not load prompt cache: {e}")
+    if len(prompts) > PROMPT_CACHE_MAX_SIZE:
+        # Only the last PROMPT_CACHE_MAX_SIZE are ever used; drop the rest from disk too
+        prompts = prompts[-PROMPT_CACHE_MAX_SIZE:]
+        compact_prompt_cache(prompts)
+    return prompts
+
+
+CACHED_PROMPTS = load_prompt_cache()
+_prompt_cache_lines = len(CACHED_PROMPTS)  # Lines currently in PROMPT_CACHE_FILE
+_prompt_cache_lock = threading.Lock()
+
+# Fresh prompts from the last batched OpenRouter call, handed out one per song.
+# Both pools hold (prompt, quote(prompt)) pairs so a prompt is URL-encoded only once.
+_prompt_queue = deque()
+_prompt_queue_lock = threading.Lock()
+
+
+def remember_prompt(entry):
+    """Adds a freshly generated (prompt, encoded) pair to the in-memory pool and the prompt to the cache file."""
+    global _prompt_cache_lines
+    prompt = entry[0]
+    with _prompt_cache_lock:
+        CACHED_PROMPTS.append(entry)
+        del CACHED_PROMPTS[:-PROMPT_CACHE_MAX_SIZE]
+        if _prompt_cache_lines >= 2 * PROMPT_CACHE_MAX_SIZE:
+            # Appends are cheap; rewrite the file only once it is twice the pool size
+            compact_prompt_cache(CACHED_PROMPTS)
+            _prompt_cache_lines = len(CACHED_PROMPTS)
+            return
+        try:
+            with open(PROMPT_CACHE_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"prompt": prompt}) + "\n")
+            _prompt_cache_lines += 1
+        except Exception as e:
+            logger.warning(f"⚠️ [PROMPT] Could not save prompt cache: {e}")
+
+
+def refill_prompt_queue():
+    """Fetches a batch of Lofi/Cinematic image prompts from OpenRouter into _prompt_queue, with unlimited retries."""
     
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -60,137 +187,477 @@ def get_openrouter_prompt():
         "model": OPENROUTER_MODEL,
         "messages": [
             {"role": "system", "content": PROMPT_SYSTEM_MESSAGE},
-            {"role": "user", "content": "Generate a Lofi-style, cinematic, music-related background image prompt."},
+            {"role": "user", "content": (
+                f"Generate {PROMPT_BATCH_SIZE} distinct Lofi-style, cinematic, music-related background image prompts "
+                "as a JSON array of strings."
+            )},
         ],
         "temperature": 0.9,
-        "max_tokens": 100,
+        "max_tokens": 120 * PROMPT_BATCH_SIZE,
     }
 
     while True: # Retry loop for OpenRouter/Image generation
-        print("\n[PROMPT] Requesting dynamic Lofi/Cinematic prompt from OpenRouter...")
+        logger.info(f"[PROMPT] Requesting {PROMPT_BATCH_SIZE} dynamic Lofi/Cinematic prompts from OpenRouter...")
         try:
-            response = requests.post(OPENROUTER_URL, headers=headers, data=json.dumps(payload), timeout=20)
+            with host_slot(OPENROUTER_URL):
+                response = SESSION.post(OPENROUTER_URL, headers=headers, data=orjson.dumps(payload), timeout=60)
             response.raise_for_status()
 
-            result = response.json()
-            generated_prompt = result['choices'][0]['message']['content'].strip()
-            return generated_prompt
+            result = orjson.loads(response.content)
+            content = result['choices'][0]['message']['content']
+            # Tolerate code fences or stray text around the array
+            prompts = orjson.loads(content[content.index('['):content.rindex(']') + 1])
+            prompts = [(p.strip(), quote(p.strip())) for p in prompts if isinstance(p, str) and p.strip()]
+            if not prompts:
+                raise ValueError("no prompts in response")
+
+            for entry in prompts:
+                remember_prompt(entry)
+            _prompt_queue.extend(prompts)
+            return
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ [ERROR] OpenRouter communication failure: {e}. Retrying in 5 seconds...")
-        except (KeyError, IndexError) as e:
-            print(f"❌ [ERROR] Error parsing OpenRouter response: {e}. Retrying in 5 seconds...")
+            logger.error(f"❌ [ERROR] OpenRouter communication failure: {e}. Retrying in 5 seconds...")
+        except (KeyError, IndexError, ValueError) as e:
+            logger.error(f"❌ [ERROR] Error parsing OpenRouter response: {e}. Retrying in 5 seconds...")
         except Exception as e:
-            print(f"❌ [ERROR] Unexpected OpenRouter error: {e}. Retrying in 5 seconds...")
+            logger.error(f"❌ [ERROR] Unexpected OpenRouter error: {e}. Retrying in 5 seconds...")
         
         time.sleep(5)
 
-def generate_and_save_image(base_filename: str):
-    """Generates an image using Pollinations and saves it to the IMAGE_FOLDER, with unlimited retries."""
+def get_openrouter_prompt():
+    """Returns a Lofi/Cinematic image (prompt, url-encoded prompt) pair from the cache or the batched OpenRouter queue."""
+
+    # The request is static, so a previously generated prompt is as good as a new sample
+    with _prompt_cache_lock:
+        if len(CACHED_PROMPTS) >= PROMPT_CACHE_MIN_SIZE and random.random() < PROMPT_CACHE_REUSE_PROBABILITY:
+            logger.info("[PROMPT] Reusing a cached Lofi/Cinematic prompt.")
+            return random.choice(CACHED_PROMPTS)
+
+    # One OpenRouter call serves PROMPT_BATCH_SIZE songs
+    with _prompt_queue_lock:
+        if not _prompt_queue:
+            refill_prompt_queue()
+        return _prompt_queue.popleft()
+
+def image_path_for(base_filename: str):
+    """Image path paired with a song: the song filename with a .jpg extension."""
+    return os.path.join(IMAGE_FOLDER, os.path.splitext(base_filename)[0] + ".jpg")
+
+
+def staged_path_for(path, doc_id):
+    """Where a document prepares `path` before publishing it (unique per document)."""
+    return f"{path}.{doc_id}{STAGING_SUFFIX}"
+
+
+def load_image_bank():
+    """Absolute paths of the pregenerated backgrounds in IMAGE_BANK_FOLDER."""
+    if not os.path.isdir(IMAGE_BANK_FOLDER):
+        return []
+    return [
+        os.path.abspath(os.path.join(IMAGE_BANK_FOLDER, f))
+        for f in sorted(os.listdir(IMAGE_BANK_FOLDER))
+        if f.lower().endswith(('.jpg', '.jpeg', '.png'))
+    ]
+
+
+BANKED_IMAGES = load_image_bank()
+
+
+def link_banked_image(final_path):
+    """Links (or copies, where symlinks aren't possible) a random banked background to final_path."""
+    source = random.choice(BANKED_IMAGES)
+    # Build the link (or copy) under a private name and rename it over final_path, so an
+    # existing link there is replaced rather than followed into the bank
+    tmp_path = f"{final_path}.{threading.get_ident()}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        # The editor only deletes the link once the video is rendered; the bank image stays
+        os.symlink(source, tmp_path)
+    except (NotImplementedError, PermissionError):
+        shutil.copyfile(source, tmp_path)  # No symlink support on this platform/filesystem
+    os.replace(tmp_path, final_path)
+    logger.info(f"✅ [IMAGE] Using banked background {os.path.basename(source)}: {final_path}")
+    return True
+
+
+def generate_and_save_image(final_path):
+    """Generates an image using Pollinations and saves it to final_path (a staging path in IMAGE_FOLDER).
+
+    Failed attempts back off exponentially and move on to the next model in MODELS;
+    returns False once MAX_IMAGE_GENERATION_RETRIES attempts have failed.
+
+    When the image bank has backgrounds (and --regenerate isn't set), one of them is reused instead.
+    """
     os.makedirs(IMAGE_FOLDER, exist_ok=True)
-    
-    while True: # Retry loop for image generation
+    if BANKED_IMAGES and not REGENERATE_IMAGES:
+        return link_banked_image(final_path)
+
+    first_model = random.randrange(len(MODELS))  # Random start spreads load across models
+    for attempt in range(MAX_IMAGE_GENERATION_RETRIES): # Retry loop for image generation
         try:
-            prompt = get_openrouter_prompt()
-            model = random.choice(MODELS)
-            encoded_prompt = quote(prompt)
+            i = (first_model + attempt) % len(MODELS)
+            model = MODELS[i]
+            prompt, encoded_prompt = get_openrouter_prompt()
 
-            url = (
-                f"https://image.pollinations.ai/prompt/{encoded_prompt}"
-                f"?model={model}&width={WIDTH}&height={HEIGHT}"
-            )
+            url = URL_TEMPLATES[i].format(p=encoded_prompt)
 
-            print(f"\n[IMAGE] Generation Details:")
-            print(f"   MODEL: {model}")
-            print(f"   PROMPT: {prompt}")
-            print("   Generating image from Pollinations...")
+            logger.info("[IMAGE] Generation Details:")
+            logger.info(f"   MODEL: {model}")
+            logger.info(f"   PROMPT: {prompt}")
+            logger.info("   Generating image from Pollinations...")
 
-            response = requests.get(url, timeout=40)
+            with host_slot(url):
+                response = SESSION.get(url, timeout=40)
             response.raise_for_status()
 
-            # Use the song filename but replace its extension with .jpg
-            image_filename = os.path.splitext(base_filename)[0] + ".jpg"
-            final_path = os.path.join(IMAGE_FOLDER, image_filename)
-
             with open(final_path, "wb") as f:
                 f.write(response.content)
 
-            print(f"✅ [IMAGE] Successfully saved: {final_path}")
+            logger.info(f"✅ [IMAGE] Successfully saved: {final_path}")
             return True
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ [IMAGE] Pollinations error: {e}. Retrying image generation in 5 seconds...")
-            time.sleep(5)
+            logger.error(f"❌ [IMAGE] Pollinations error with model {model} ({attempt + 1}/{MAX_IMAGE_GENERATION_RETRIES}): {e}")
         except Exception as e:
-            print(f"❌ [IMAGE] Unexpected error in image process: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
+            logger.error(f"❌ [IMAGE] Unexpected error in image process ({attempt + 1}/{MAX_IMAGE_GENERATION_RETRIES}): {e}")
+
+        if attempt < MAX_IMAGE_GENERATION_RETRIES - 1:
+            delay = min(60, 2 ** attempt)
+            logger.info(f"   Retrying image generation with the next model in {delay} seconds...")
+            time.sleep(delay)
+
+    logger.error(f"❌ [IMAGE] Giving up on {final_path} after {MAX_IMAGE_GENERATION_RETRIES} attempts.")
+    return False
 
 
 # --- Core Download Logic ---
 
+class RangeNotSupported(Exception):
+    """The server ignored a Range request (answered 200 instead of 206)."""
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+    return offset
+
+
+def _ranged_download(url, path, parts=RANGED_DOWNLOAD_PARTS):
+    """Downloads url into path as `parts` parallel HTTP byte ranges.
+
+    Returns False without downloading when the server doesn't advertise range
+    support, rejects the HEAD probe, or the file is small, so the caller can
+    stream it normally.
+    """
+    identity = {"Accept-Encoding": "identity"}  # Ranges must address the raw bytes
+    try:
+        with host_slot(url):
+            head = SESSION.head(url, headers=identity, allow_redirects=True, timeout=20)
+        head.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        # Hosts like S3 presigned URLs or CDNs often reject HEAD (403/405) but serve GET fine
+        logger.info(f"[DOWNLOAD] HEAD request failed ({e}). Using a single stream.")
+        return False
+    size = int(head.headers.get('content-length', 0))
+    if head.headers.get('accept-ranges', '').lower() != 'bytes' or size < RANGED_DOWNLOAD_MIN_BYTES:
+        return False
+
+    step = -(-size // parts)  # ceil division
+    ranges = [(lo, min(lo + step, size) - 1) for lo in range(0, size, step)]
+
+    progress_bar = tqdm(
+        total=size, unit='iB', unit_scale=True, unit_divisor=1024,
+        desc=f"   Progress x{len(ranges)}", ncols=80, file=sys.stdout, leave=False,
+        mininterval=0.5, miniters=1  # Redraw at most twice a second
+    )
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)  # Reserve the whole file so parts land in place
+        except OSError:
+            pass  # Filesystem without fallocate support; pwrite still fills the holes
+
+    def fetch_part(lo, hi):
+        headers = dict(identity, Range=f"bytes={lo}-{hi}")
+        with host_slot(url), SESSION.get(url, headers=headers, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RangeNotSupported(f"HTTP {response.status_code} for range {lo}-{hi}")
+            offset = lo
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                offset = _pwrite_all(fd, chunk, offset)
+                progress_bar.update(len(chunk))
+        if offset != hi + 1:
+            raise requests.exceptions.ChunkedEncodingError(f"Range {lo}-{hi} ended early at byte {offset}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            for future in [pool.submit(fetch_part, lo, hi) for lo, hi in ranges]:
+                future.result()
+    except RangeNotSupported as e:
+        logger.info(f"[DOWNLOAD] Server ignored byte ranges ({e}). Falling back to a single stream.")
+        return False
+    finally:
+        os.close(fd)
+        progress_bar.close()
+
+    return True
+
+
+_download_locks = {}  # absolute final path -> [lock, threads holding or waiting on it]
+_download_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _download_lock(final_path):
+    """Serializes downloads into the same file (and its .part); the entry is dropped once unused."""
+    key = os.path.abspath(final_path)
+    with _download_locks_guard:
+        entry = _download_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _download_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _download_locks[key]
+
+
 def fast_download_with_retry(url, final_path):
+    """Download a file unless it is already on disk; downloads to the same path wait for the first."""
+    with _download_lock(final_path):
+        if os.path.exists(final_path) and os.path.getsize(final_path) > 0:
+            logger.info(f"♻️ [DOWNLOAD] Already downloaded, skipping: {final_path}")
+            return os.path.basename(final_path)
+        return _download_with_retry(url, final_path)
+
+
+def _download_with_retry(url, final_path):
     """Download a file with a single-line progress bar and retries."""
 
-    os.makedirs(TEMP_FOLDER, exist_ok=True)
-    temp_path = os.path.join(TEMP_FOLDER, os.path.basename(final_path))
+    # Stream into a .part file next to the final one (ignored by the editor's extension
+    # filter), so publishing is a same-directory atomic rename, never a cross-device copy
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    part_path = final_path + ".part"
+    resume_validator = None # Strong ETag (or Last-Modified) of the bytes already in part_path
     
     for attempt in range(MAX_SONG_DOWNLOAD_RETRIES):
-        print(f"\n[DOWNLOAD] Attempt {attempt + 1}/{MAX_SONG_DOWNLOAD_RETRIES}: Starting download...\n   URL: {url}")
+        logger.info(f"[DOWNLOAD] Attempt {attempt + 1}/{MAX_SONG_DOWNLOAD_RETRIES}: Starting download...\n   URL: {url}")
         
         try:
-            # 1. Start the request in stream mode
-            with requests.get(url, stream=True, timeout=60) as response:
-                response.raise_for_status() # Raises an HTTPError for bad responses (4xx or 5xx)
-
-                total_size_in_bytes = int(response.headers.get('content-length', 0))
-                # Increased chunk size to 8MB for faster throughput
-                block_size = 8 * 1024 * 1024 
-
-                # 2. Use tqdm for the progress bar - CONFIGURATION FOR SINGLE LINE
-                progress_bar = tqdm(
-                    total=total_size_in_bytes, 
-                    unit='iB', 
-                    unit_scale=True, 
-                    unit_divisor=1024,
-                    desc="   Progress", 
-                    ncols=80, 
-                    file=sys.stdout,
-                    leave=False # <--- KEY CHANGE: Ensures the bar stays on one line
-                )
-                
-                with open(temp_path, 'wb') as temp_file:
-                    for chunk in response.iter_content(chunk_size=block_size):
-                        if chunk:
-                            temp_file.write(chunk)
-                            progress_bar.update(len(chunk))
-                
-                progress_bar.close()
-
-            # 3. Download successful, move file
-            # The progress bar line is now gone/replaced by the following print.
-            print("[DOWNLOAD] Finished. Moving to output folder...") 
-            os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-            os.replace(temp_path, final_path)
+            resume_from = os.path.getsize(part_path) if resume_validator and os.path.exists(part_path) else 0
 
-            print(f"🎉 [DOWNLOAD] File saved successfully: {final_path}")
+            # 1. Fast path: parallel byte-range download when the server supports it
+            if not resume_from and hasattr(os, "pwrite") and _ranged_download(url, part_path):
+                pass
+            else:
+                # 1b. Start the request in stream mode, resuming a previous partial attempt if possible
+                headers = {"Accept-Encoding": "identity"} # Byte offsets must refer to the raw file
+                if resume_from:
+                    # If-Range: the server sends the whole file (200) instead if it changed meanwhile
+                    headers.update({"Range": f"bytes={resume_from}-", "If-Range": resume_validator})
+                    logger.info(f"   Resuming from byte {resume_from}...")
+
+                # The host slot stays held while the body streams
+                with host_slot(url), SESSION.get(url, headers=headers, stream=True, timeout=60) as response:
+                    if response.status_code == 416:
+                        resume_validator = None # Partial file is unusable; start over next attempt
+                    response.raise_for_status() # Raises an HTTPError for bad responses (4xx or 5xx)
+                    if response.status_code != 206:
+                        resume_from = 0 # Full body: first attempt, or the file changed since
+
+                    etag = response.headers.get('etag', '')
+                    resume_validator = etag if etag and not etag.startswith('W/') else response.headers.get('last-modified')
+
+                    content_length = int(response.headers.get('content-length', 0))
+                    total_size_in_bytes = resume_from + content_length if content_length else 0
+                    # Increased chunk size to 8MB for faster throughput
+                    block_size = 8 * 1024 * 1024 
+
+                    # 2. Copy the raw body in shutil's C-level loop; tqdm wraps raw.read
+                    # for the progress bar - CONFIGURATION FOR SINGLE LINE
+                    response.raw.decode_content = True
+                    with tqdm.wrapattr(
+                        response.raw, "read",
+                        total=total_size_in_bytes, 
+                        initial=resume_from,
+                        desc="   Progress", 
+                        ncols=80, 
+                        file=sys.stdout,
+                        mininterval=0.5, # Redraw at most twice a second, however small the reads
+                        miniters=1,
+                        leave=False # <--- KEY CHANGE: Ensures the bar stays on one line
+                    ) as raw_stream, open(part_path, 'r+b' if resume_from else 'wb') as part_file:
+                        part_file.seek(resume_from)
+                        if total_size_in_bytes and hasattr(os, "posix_fallocate"):
+                            try:
+                                # Reserve the whole file up front instead of growing it chunk by chunk
+                                os.posix_fallocate(part_file.fileno(), 0, total_size_in_bytes)
+                            except OSError:
+                                pass  # Filesystem without fallocate support
+                        try:
+                            shutil.copyfileobj(raw_stream, part_file, block_size)
+                        except Urllib3Error as e:
+                            # raw.read raises urllib3 errors; route them into the normal retry path
+                            raise requests.exceptions.ChunkedEncodingError(e)
+                        finally:
+                            # Drop the unwritten preallocated tail so a resume starts at the real end
+                            part_file.truncate()
+                        if total_size_in_bytes and part_file.tell() != total_size_in_bytes:
+                            raise requests.exceptions.ChunkedEncodingError(
+                                f"Connection closed at byte {part_file.tell()} of {total_size_in_bytes}"
+                            )
+
+            # 3. Download successful, publish file
+            # The progress bar line is now gone/replaced by the following log line.
+            logger.info("[DOWNLOAD] Finished. Renaming into place...")
+            os.replace(part_path, final_path)
+
+            logger.info(f"🎉 [DOWNLOAD] File saved successfully: {final_path}")
             return os.path.basename(final_path)
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ [DOWNLOAD] Attempt {attempt + 1} failed: {e}")
+            logger.error(f"❌ [DOWNLOAD] Attempt {attempt + 1} failed: {e}")
             if attempt < MAX_SONG_DOWNLOAD_RETRIES - 1:
-                print("   Retrying download in 3 seconds...")
+                logger.info("   Retrying download in 3 seconds...")
                 time.sleep(3)
             else:
-                print(f"❌ [DOWNLOAD] Final attempt failed. Skipping this song.")
-                # Clean up the failed temporary file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
+                logger.error("❌ [DOWNLOAD] Final attempt failed. Skipping this song.")
+                # Clean up the failed partial file
+                if os.path.exists(part_path):
+                    os.remove(part_path)
                 return None
         except Exception as e:
-            print(f"❌ [DOWNLOAD] Unexpected error: {e}")
+            logger.error(f"❌ [DOWNLOAD] Unexpected error: {e}")
             return None
 
 
+# --- Per-Document Processing ---
+
+# Image generation runs on its own pool so it overlaps the song download of the same document
+IMAGE_POOL = ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY)
+
+
+def release_stale_claims(collection):
+    """Releases claims older than CLAIM_TIMEOUT_SECONDS (left by a crashed worker) back to the queue."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)
+    result = collection.update_many(
+        {'_claimed_at': {'$lt': cutoff}},
+        {'$unset': {'_status': '', '_worker': '', '_claimed_at': ''}}
+    )
+    if result.modified_count:
+        logger.info(f"♻️ [QUEUE] Released {result.modified_count} abandoned claim(s).")
+
+
+def claim_documents(collection, limit):
+    """Claims up to `limit` unclaimed documents for this worker in three round-trips."""
+    now = datetime.now(timezone.utc)
+    # Unclaimed and released documents have no _claimed_at. The equality match walks
+    # claim_idx in _id order, so the poll reads just `limit` keys however long the queue is.
+    claimable = {'_claimed_at': None}
+
+    # An empty queue costs a single read; nothing is written until there is work
+    candidates = list(
+        collection.find(claimable, projection={"_id": 1})
+        .sort('_id', pymongo.ASCENDING)
+        .limit(limit)
+    )
+    if not candidates:
+        return []
+
+    ids = [d["_id"] for d in candidates]
+    collection.update_many(
+        {"_id": {"$in": ids}, **claimable},
+        {'$set': {'_status': 'processing', '_worker': WORKER_ID, '_claimed_at': now}}
+    )
+    # Another worker may have claimed some of them between the find and the update
+    return list(
+        collection.find({"_id": {"$in": ids}, "_worker": WORKER_ID}, projection={"songUrl": 1})
+        .sort('_id', pymongo.ASCENDING)
+    )
+
+
+def _discard(path):
+    """Removes a staged file (or link) that will never be published."""
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def process_document(collection, doc):
+    """Downloads the song and generates its image for one claimed document.
+
+    Returns True on success, False if the document is finished but failed
+    (either way the caller deletes it), or None if it was released for a retry.
+    """
+    song_url = doc.get("songUrl")
+    doc_id = doc.get("_id")
+
+    try:
+        if not song_url:
+            logger.error(f"🚨 [QUEUE] Document ID {doc_id} missing 'songUrl'. Deleting incomplete document.")
+            return False
+
+        filename = song_url.split("/")[-1]
+        final_audio_path = os.path.join(OUTPUT_FOLDER, filename)
+        final_image_path = image_path_for(filename)
+
+        # The editor pairs images and songs by sorted position, so neither file may appear
+        # in its folders until both exist. Both are prepared under staging names first.
+        staged_audio_path = staged_path_for(final_audio_path, doc_id)
+        staged_image_path = staged_path_for(final_image_path, doc_id)
+
+        # 2b/2c. Generate the image while the song downloads; they hit unrelated services
+        # and the image only needs the song's file name.
+        image_future = IMAGE_POOL.submit(generate_and_save_image, staged_image_path)
+
+        if os.path.exists(final_audio_path) and os.path.getsize(final_audio_path) > 0:
+            # An earlier document already published this song; only its image is needed
+            logger.info(f"♻️ [DOWNLOAD] Already downloaded, skipping: {final_audio_path}")
+            staged_audio_path = None
+            song_filename_base = filename
+        else:
+            song_filename_base = fast_download_with_retry(song_url, staged_audio_path)
+        image_success = image_future.result()
+
+        if not song_filename_base:
+            # Download failed after all retries. Drop the unpublished image and clean up DB record.
+            logger.error(f"❌ [PROCESS] Song download failed for {doc_id} after all retries. Deleting record.")
+            _discard(staged_image_path)
+            return False
+
+        if not image_success:
+            # Pollinations kept failing. Drop the unpublished song so it never reaches the editor alone.
+            logger.warning(f"⚠️ [PROCESS] Unrecoverable Image generation failure for {doc_id}. Deleting DB record.")
+            if staged_audio_path:
+                _discard(staged_audio_path)
+            return False
+
+        # Publish: plain renames within each folder
+        if staged_audio_path:
+            os.replace(staged_audio_path, final_audio_path)
+        os.replace(staged_image_path, final_image_path)
+        logger.info(f"📦 [PROCESS] Published {final_audio_path} and {final_image_path}")
+
+        # 2d. Done: the caller deletes the processed document with the rest of the batch
+        logger.info(f"👍 [PROCESS] Completed task for ID {doc_id}. Deleting document from MongoDB.")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ [WORKER ERROR] Failed processing document {doc_id}: {e}. Releasing it for a later retry.")
+        try:
+            collection.update_one({"_id": doc_id}, {'$unset': {'_status': '', '_worker': '', '_claimed_at': ''}})
+        except pymongo.errors.PyMongoError:
+            pass  # Reclaimed once the claim goes stale instead
+        return None
+
+
 # --- Server Worker Loop ---
 
 def worker_loop():
@@ -203,116 +670,132 @@ def worker_loop():
     
     for attempt in range(MAX_MONGO_CONNECT_RETRIES):
         try:
-            print(f"Attempting to connect to MongoDB... ({attempt + 1}/{MAX_MONGO_CONNECT_RETRIES})")
-            client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+            logger.info(f"Attempting to connect to MongoDB... ({attempt + 1}/{MAX_MONGO_CONNECT_RETRIES})")
+            client = pymongo.MongoClient(
+                MONGO_URI,
+                serverSelectionTimeoutMS=5000,
+                # Enough pooled connections for the concurrent document threads
+                maxPoolSize=50,
+                minPoolSize=5,
+                maxIdleTimeMS=300000,
+                # Wire compression (codecs from pymongo[zstd,snappy]); the server picks the first it supports
+                compressors="zstd,snappy,zlib",
+                retryWrites=True,
+            )
             client.admin.command("ping")
             
-            print("=========================================")
-            print("✅ Connected to MongoDB Atlas! Worker starting...")
-            print("=========================================")
+            logger.info("=========================================")
+            logger.info("✅ Connected to MongoDB Atlas! Worker starting...")
+            logger.info("=========================================")
             db = client[DATABASE_NAME]
             collection = db[COLLECTION_NAME]
             break # Exit the retry loop on success
 
         except ConnectionFailure:
-            print("❌ MongoDB connection error. Retrying in 5 seconds...")
+            logger.error("❌ MongoDB connection error. Retrying in 5 seconds...")
             time.sleep(5)
         except OperationFailure as e:
-            print(f"❌ MongoDB permission/operation error: {e}. Retrying in 5 seconds...")
+            logger.error(f"❌ MongoDB permission/operation error: {e}. Retrying in 5 seconds...")
             time.sleep(5)
         except Exception as e:
-            print(f"❌ Unexpected error during MongoDB connection: {e}. Retrying in 5 seconds...")
+            logger.error(f"❌ Unexpected error during MongoDB connection: {e}. Retrying in 5 seconds...")
             time.sleep(5)
     else:
         # This code runs if all retries failed
-        print("❌ CRITICAL: Failed to connect to MongoDB after multiple retries. Cannot start worker.")
+        logger.error("❌ CRITICAL: Failed to connect to MongoDB after multiple retries. Cannot start worker.")
         return
 
+    # Index-backed queue polls (claim filter + _id order) instead of collection scans
+    try:
+        collection.create_index([("_claimed_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)], name="claim_idx")
+    except OperationFailure as e:
+        logger.warning(f"⚠️ Could not create queue index (continuing without it): {e}")
+
     # Initialize counter for log cleanup
     processed_count = 0
+    next_stale_check = 0.0  # Sweep abandoned claims right away, then every STALE_CLAIM_CHECK_INTERVAL
     
     # 2. Start the infinite loop
-    while True:
-        try:
-            # 2a. Find and retrieve ONE document, including its unique ID
-            doc = collection.find_one_and_update(
-                {}, # Query: finds the first document
-                {'$set': {'_status': 'processing'}}, 
-                projection={"songUrl": 1},
-                sort=[('_id', pymongo.ASCENDING)]
-            )
-
-            if not doc:
-                print(f"\n[QUEUE] Database is empty. Checking again in 10 seconds...")
+    # Downloads and image generation are network-bound, so documents are
+    # processed concurrently on a thread pool sharing the HTTP session. Free
+    # slots are refilled as soon as any document finishes, so one slow song
+    # never leaves the rest of the pool idle.
+    in_flight = {}        # future -> claimed document
+    pending_deletes = []  # Finished documents not yet deleted from MongoDB
+    with ThreadPoolExecutor(max_workers=WORKER_CONCURRENCY) as pool:
+        while True:
+            try:
+                if time.monotonic() >= next_stale_check:
+                    release_stale_claims(collection)
+                    next_stale_check = time.monotonic() + STALE_CLAIM_CHECK_INTERVAL
+
+                # 2a. Claim enough unclaimed documents to fill the free slots
+                free_slots = WORKER_CONCURRENCY - len(in_flight)
+                if free_slots:
+                    docs = claim_documents(collection, free_slots)
+                    for doc in docs:
+                        in_flight[pool.submit(process_document, collection, doc)] = doc
+                    if docs:
+                        logger.info(f"[QUEUE] Claimed {len(docs)} document(s). {len(in_flight)} in progress.")
+
+                if not in_flight:
+                    logger.info("[QUEUE] Database is empty. Checking again in 10 seconds...")
+                    time.sleep(10)
+                    continue
+
+                # Wait for the next finished document; with free slots, look for new work every 10 seconds
+                done, _ = wait(
+                    in_flight,
+                    timeout=10 if len(in_flight) < WORKER_CONCURRENCY else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    doc = in_flight.pop(future)
+                    result = future.result()  # process_document handles its own errors
+                    if result:
+                        processed_count += 1
+                    if result is not None:
+                        pending_deletes.append(DeleteOne({"_id": doc["_id"]}))
+
+                # 2d. Cleanup: Delete every finished document in one round-trip
+                if pending_deletes:
+                    collection.bulk_write(pending_deletes, ordered=False)
+                    pending_deletes = []
+                
+                # 2e. Log Cleanup
+                if processed_count >= LOG_CLEANUP_INTERVAL:
+                    logger.info("=========================================")
+                    logger.info(f"🧹 CLEARED LOGS AFTER {processed_count} PROCESSES")
+                    logger.info("=========================================")
+                    processed_count = 0
+
+            except pymongo.errors.PyMongoError as e:
+                # Catch MongoDB specific errors that might occur during the loop (e.g., connection drop)
+                logger.error(f"❌ [WORKER ERROR] MongoDB operational error: {e}. Sleeping and continuing...")
                 time.sleep(10)
-                continue 
-
-            song_url = doc.get("songUrl")
-            doc_id = doc.get("_id")
-
-            if not song_url:
-                print(f"🚨 [QUEUE] Document ID {doc_id} missing 'songUrl'. Deleting incomplete document.")
-                collection.delete_one({"_id": doc_id})
-                continue
-
-            # 2b. Process: Download Song (with retry logic and progress bar)
-            filename = song_url.split("/")[-1]
-            final_audio_path = os.path.join(OUTPUT_FOLDER, filename)
-
-            song_filename_base = fast_download_with_retry(song_url, final_audio_path)
-
-            if not song_filename_base:
-                # Download failed after all retries. Clean up DB record.
-                print(f"❌ [PROCESS] Song download failed for {doc_id} after all retries. Deleting record.")
-                collection.delete_one({"_id": doc_id})
-                time.sleep(1)
-                continue
-
-            # 2c. Process: Generate Image (with infinite retry logic)
-            image_success = generate_and_save_image(song_filename_base)
-
-            if not image_success:
-                 # Should only happen on a critical local I/O error, but included for completeness.
-                print(f"⚠️ [PROCESS] Unrecoverable Image generation failure for {doc_id}. Deleting DB record.")
-                collection.delete_one({"_id": doc_id})
-                time.sleep(1)
-                continue
-
-
-            # 2d. Cleanup: Delete the processed document
-            print(f"👍 [PROCESS] Completed task for ID {doc_id}. Deleting document from MongoDB.")
-            collection.delete_one({"_id": doc_id})
-            
-            processed_count += 1
-            
-            # 2e. Log Cleanup
-            if processed_count >= LOG_CLEANUP_INTERVAL:
-                print(f"\n\n=========================================")
-                print(f"🧹 CLEARED LOGS AFTER {processed_count} PROCESSES")
-                print(f"=========================================\n\n")
-                processed_count = 0
-
-            # Short break before processing the next item to prevent API throttling
-            print("-----------------------------------------")
-            time.sleep(2)
-
-        except pymongo.errors.PyMongoError as e:
-            # Catch MongoDB specific errors that might occur during the loop (e.g., connection drop)
-            print(f"❌ [WORKER ERROR] MongoDB operational error: {e}. Sleeping and continuing...")
-            time.sleep(10)
-        except requests.exceptions.RequestException as e:
-            print(f"❌ [WORKER ERROR] HTTP/API communication error: {e}")
-            time.sleep(5)
-        except Exception as e:
-            print(f"❌ [WORKER ERROR] Unexpected error in main loop: {e}")
-            time.sleep(5)
+            except requests.exceptions.RequestException as e:
+                logger.error(f"❌ [WORKER ERROR] HTTP/API communication error: {e}")
+                time.sleep(5)
+            except Exception as e:
+                logger.error(f"❌ [WORKER ERROR] Unexpected error in main loop: {e}")
+                time.sleep(5)
 
     if client:
         client.close()
-        print("🔒 MongoDB connection closed.")
+        logger.info("🔒 MongoDB connection closed.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download queued songs and prepare their background images.")
+    parser.add_argument(
+        "--regenerate", action="store_true",
+        help=f"generate every image through Pollinations instead of reusing {IMAGE_BANK_FOLDER}/",
+    )
+    REGENERATE_IMAGES = parser.parse_args().regenerate
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", stream=sys.stdout)
+    if BANKED_IMAGES and not REGENERATE_IMAGES:
+        logger.info(f"🖼️ Image bank: {len(BANKED_IMAGES)} background(s) in {IMAGE_BANK_FOLDER}/")
     # NOTE: Ensure you have the required libraries installed:
-    # pip install requests pymongo tqdm
+    # pip install requests "pymongo[zstd,snappy]" tqdm orjson
     worker_loop()